@@ -1,13 +1,15 @@
 #!/bin/python3
 
 import argparse
-import serial
-import time
+import asyncio
+import serial_asyncio
 import math
 import itertools
-from PIL import Image, ImageOps, ImageDraw
+import numpy as np
+from PIL import Image
 
-class Driver:
+class DriverBase:
+	"""Printer constants and image conversion shared by Driver and AsyncDriver"""
 	## Constants
 	ANSWER_GOT_INSTRUCTION = b'\x00'	# Printer got instruction
 	ANSWER_STATUS_DONE = b'\x20'		# Instruction Done
@@ -53,174 +55,13 @@ class Driver:
 	SERIAL_COMMAND_TIMEOUT = 10 # 10 seconds
 	SERIAL_CHAR_DELAY = 0.0025 # (0.001 on laptop)
 
-	## Variables
-	curY = 0				# current y position
-	curX = 0				# current x position
-	serialPort = ""			# path to serial port
-	ser = serial.Serial()	# Serial interface
+	NEST_SPACING = 4			# Gap in pixels between nested images
 
-	def _SerialInit(self):
-		"""Initializes the serial port.
-		Throws exception if port could not be opened"""
-		# Baudrate required by printer
-		self.ser.baudrate = 9600
-		# Timeout
-		self.ser.timeout = self.SERIAL_COMMAND_TIMEOUT
-		try:
-			self.ser.port = self.serialPort
-			self.ser.open()
-			self.ser.reset_input_buffer()
-			self.ser.reset_output_buffer()
-		except Exception as e:
-			print("Could not open serial port: " + self.serialPort)
-			raise e 
-			exit()
-
-
-	def _SendData(self, barrData, doACKCheck = True):
-		"""Sends a bytearray to the printer.
-		Makes a SERIAL_CHAR_DELAY long delay after each byte since the 
-		printer needs time to process each byte"""
-
-		self.ser.timeout = self.SERIAL_CHAR_DELAY
-
-		for idx,data in enumerate(barrData):
-			#self.ser.reset_input_buffer() # Clear all unread data
-			dataByte = bytes([(data & 0xFF)])
-			self.ser.write(dataByte)
-			if(idx == 0):
-				# "Command" -> expected Answer is 0x00
-				self.ser.timeout = self.SERIAL_COMMAND_TIMEOUT
-
-				serValue = self.ser.read(1)
-				if(serValue == self.ANSWER_STATUS_DONE):
-					doACKCheck = False
-				elif(serValue != self.ANSWER_GOT_INSTRUCTION):
-					raise ConnectionError("Did not ACK instruction, got "+str(serValue)+" instead")
-
-				self.ser.timeout = self.SERIAL_CHAR_DELAY
-
-			# Check for lost Data!
-			serValue = self.ser.read(1)
-			if(serValue and len(serValue) > 0):
-				# Got data byte where we should not have
-				
-				if(serValue == self.ANSWER_PAUSE_DATA):
-					
-					self.ser.timeout = self.SERIAL_COMMAND_TIMEOUT
-					serValue = 0xFF
-					# Wait until we can send more data: -> read blocks!
-					while(serValue != self.ANSWER_GOT_INSTRUCTION):
-						buf = self.ser.read(1)
-						if(buf and len(buf) > 0):
-							serValue = buf
-							if(serValue == self.ANSWER_DROPPED_DATA):
-								raise ConnectionError("Dropped some data!")
-						else:
-							# Timeout
-							raise ConnectionError("Did not get a continue in time!")
-					self.ser.timeout = self.SERIAL_CHAR_DELAY
-
-				elif(serValue == self.ANSWER_STATUS_DONE):
-					doACKCheck = False
-				else:
-					print("Got unknown data packet during transmission: "+str(serValue))
-		
-		self.ser.timeout = self.SERIAL_COMMAND_TIMEOUT
-
-		if(doACKCheck):
-			serValue = 0xFF
-			while(serValue != self.ANSWER_STATUS_DONE):
-				buf = self.ser.read(1)
-				if(buf and len(buf) > 0):
-					serValue = buf
-				else:
-					# Timeout
-					raise ConnectionError("Did not get an ACK in time!")
-			
-
-	def _DiscoverPrinter(self):
-		"""Sends a discovery sequence to the printer and awaits a response.
-		Throws exception if no answer was received"""
-		self._SendData(self.CMD_START)
-		self.ser.write(self.CMD_DISCOVERY)
-		# Printer usually sends 3 bytes, the discovery answer being the last one
-		retVal = self.ser.read(1)
-		if(retVal != self.ANSWER_DISCOVERY):
-			raise ConnectionAbortedError("No EZ30 printer connected to port \""+self.serialPort+"\"")
-		self._SendData(self.CMD_RESET)
-
-	def _MoveHeadY(self, absolutePos):
-		"""Set absolute y direction of print head"""
-		barrData = [0] * 2
-		relativePos = abs(absolutePos-self.curY)
-		# Check in which direction to move
-		if(absolutePos >= self.curY):
-			barrData[0] = self.CMD_Y_MOVE_RIGHT[0]
-		else:
-			barrData[0] = self.CMD_Y_MOVE_LEFT[0]
-		barrData[1] = relativePos
-		if(relativePos > 0):
-			self._SendData(barrData)
-			self.curY = absolutePos
-
-	def _MoveHeadX(self, absolutePos):
-		"""Set absolute x direction of print head"""
-		if(absolutePos < self.curX):
-			# Cant move upwards
-			return -1;
-		relativePos = absolutePos-self.curX
-		for i in range(relativePos // 8):
-			self._SendData(self.CMD_LINE_FEED)
-		for i in range(relativePos % 8):
-			self._SendData(self.CMD_HI_RES_SECOND_LINE)
-		self.curX = absolutePos
-
-	def _MoveHeadHome(self):
-		"""Moves head back to home"""
-		self._SendData(self.CMD_HOME)
-		self.curY = 0
-
-	def _MoveHead(self, X,Y):
-		"""Sets x and y position of print head"""
-		self._MoveHeadX(X)
-		self._MoveHeadY(Y)
-
-	def _MoveDown(self):
-		"""Moves 1 line down"""
-		self._SendData(self.CMD_HI_RES_LINEFEED)
-		self._SendData(self.CMD_HI_RES_SECOND_LINE)
-
-	def _InitEZ30(self):
-		"""Initializes the EZ30 printer"""
-		self._SendData(self.CMD_INIT_SEQUENCE)
-		self._SendData(self.CMD_HOME)
-		self._initResMode(True) # Standard Init in High res mode
-		self.curX = 0
-		self.curY = 0
-
-	def _EndPrint(self):
-		"""Feeds label out"""
-		self._SendData(self.CMD_HOME)
-		self._SendData(self.CMD_FEED_LABEL_OUT)
-
-	def _PrintImageLine(self, barrImageData, length):
-		"""Prints one line of image data"""
-		# Have to send start byte and length as well
-		barrLength = length + 1 + len(self.CMD_IMAGE_SEQUENCE_START)
-		barrData = [0] * barrLength
-		barrData[0] = self.CMD_IMAGE_SEQUENCE_START[0]
-		barrData[1] = length
-		# Copy image data
-		for i in range (length):
-			barrData[2+i] = barrImageData[i]
-		# Increment current y position
-		self.curY += length
-		self._SendData(barrData)
+	ROTATIONS = (None, Image.ROTATE_90, Image.ROTATE_180, Image.ROTATE_270)	# Transpose for each counter-clockwise quarter turn
 
-	def _ResizeImage(self,image, isHighRes: bool = False):
-		"""Resizes the passed image to fit on the label.
-		Returns resized image object"""
+	def _LoadImage(self, image, rotation: int = 0):
+		"""Opens the passed image and rotates it by rotation counter-clockwise quarter turns.
+		Returns the image object"""
 
 		if(isinstance(image, str)):
 			img = Image.open(image)
@@ -229,6 +70,18 @@ class Driver:
 		else:
 			raise ValueError("image parameter is neither a string nor an Image object!")
 
+		# Lossless rotation, done once right before conversion
+		transpose = self.ROTATIONS[rotation % 4]
+		if(transpose is not None):
+			img = img.transpose(transpose)
+		return img
+
+	def _ResizeImage(self,image, isHighRes: bool = False, rotation: int = 0):
+		"""Rotates the passed image by rotation counter-clockwise quarter turns
+		and resizes it to fit on the label.
+		Returns resized image object"""
+		img = self._LoadImage(image, rotation)
+
 		maxWidth = self.PRINTER_WIDTH
 		maxHeight = self.PRINTER_HEIGHT
 		if(isHighRes):
@@ -247,12 +100,6 @@ class Driver:
 
 		return newImg
 
-	def _initResMode(self, isHighRes:bool = False):
-		if isHighRes:
-			self._SendData(self.CMD_HI_RES_INIT)
-		else:	
-			self._SendData(self.CMD_LO_RES_INIT)
-
 	def _ConvertImageTo1bppx(self,img, threshold):
 		"""Converts the image object "img" to a 1bppx array.
 		Returns this array as well as the size of the image"""
@@ -322,13 +169,14 @@ class Driver:
 				ez30ImageData.append(bytearray(row))
 		return ez30ImageData
 
-	def _ConvertImage(self, image, threshold: int, isHighRes: bool = False):
+	def _ConvertImage(self, image, threshold: int, isHighRes: bool = False, rotation: int = 0):
 		"""Converts image to EZ30 format
 		image{str||Image}: 	Path to the image file or Image object that should be printed on the label
-		threshold{int}:		Threshold for converting the image to 1bppx"""
+		threshold{int}:		Threshold for converting the image to 1bppx
+		rotation{int}:		Number of counter-clockwise quarter turns applied to the image"""
 		# convert image to a list of pixels
 		
-		resizedImage = self._ResizeImage(image, isHighRes)
+		resizedImage = self._ResizeImage(image, isHighRes, rotation)
 		pixelData, imgWidth, imgHeight = self._ConvertImageTo1bppx(resizedImage, threshold)
 		ez30ImageData = self._Convert1bppxImageToEZ30Data(pixelData, imgWidth, imgHeight, isHighRes)
 		return ez30ImageData	
@@ -360,113 +208,579 @@ class Driver:
 		# remove empty arrays at the end (so we dont print them)
 		return list(reversed(tuple(itertools.dropwhile(lambda x: x == [], reversed(lineData)))))
 
+	def _ConvertNestItem(self, image, threshold: int, isHighRes: bool = False, rotation: int = 0):
+		"""Converts a single image for nesting. Unlike _ResizeImage the image keeps its size
+		and is only shrunk (keeping the aspect ratio) if it does not fit on the label.
+		Returns an array with one row per image row, 1 for printed pixels"""
+		img = self._LoadImage(image, rotation)
+
+		maxWidth = self.PRINTER_WIDTH
+		maxHeight = self.PRINTER_HEIGHT
+		if(isHighRes):
+			maxWidth = self.PRINTER_HI_RES_WIDTH
+			maxHeight = self.PRINTER_HI_RES_HEIGHT
+
+		scale = min(1, maxWidth / img.size[0], maxHeight / img.size[1])
+		if(scale < 1):
+			img = img.resize((max(1, int(img.size[0] * scale)), max(1, int(img.size[1] * scale))))
+		pixelData, imgWidth, imgHeight = self._ConvertImageTo1bppx(img, threshold)
+		return (np.array(pixelData, dtype=np.uint8) != 0).astype(np.uint8).reshape(imgHeight, imgWidth)
+
+	def _NestLayout(self, sizes, maxWidth, maxHeight):
+		"""Packs rectangles with the given (width, height) onto labels of maxWidth x maxHeight pixels.
+		Uses first fit decreasing height shelf packing: images are placed side by side on shelves,
+		shelves one below another, a new label is started when no shelf fits.
+		Returns a list of labels, each a list of (itemIdx, x, y) placements"""
+		labels = []
+		"""label object format: {height: int, shelves: [{x: int, y: int}], placements: []} height: used height, x: next free x on the shelf"""
+		for itemIdx in sorted(range(len(sizes)), key=lambda idx: sizes[idx][1], reverse=True):
+			width, height = sizes[itemIdx]
+			placement = None
+			for label in labels:
+				# Shelves are at least as high as the image since images are sorted by height
+				for shelf in label["shelves"]:
+					if(shelf["x"] + width <= maxWidth):
+						placement = (itemIdx, shelf["x"], shelf["y"])
+						shelf["x"] += width + self.NEST_SPACING
+						break
+				if(placement is None and label["height"] + height <= maxHeight):
+					# Open a new shelf below the last one
+					placement = (itemIdx, 0, label["height"])
+					label["shelves"].append({"x": width + self.NEST_SPACING, "y": label["height"]})
+					label["height"] += height + self.NEST_SPACING
+				if(placement is not None):
+					label["placements"].append(placement)
+					break
+			if(placement is None):
+				labels.append({"height": height + self.NEST_SPACING, "shelves": [{"x": width + self.NEST_SPACING, "y": 0}], "placements": [(itemIdx, 0, 0)]})
+		return [label["placements"] for label in labels]
+
+	def NestLabels(self, items, isHighRes: bool = False):
+		"""Nests several small images onto as few labels as possible
+		items{list}:		(image, threshold, rotation) tuple for each image, see PrintLabel
+		Returns a list of labels, each a dict {items: [itemIdx], imageData: []} with the EZ30 data of the label"""
+		maxWidth = self.PRINTER_WIDTH
+		maxHeight = self.PRINTER_HEIGHT
+		if(isHighRes):
+			maxWidth = self.PRINTER_HI_RES_WIDTH
+			maxHeight = self.PRINTER_HI_RES_HEIGHT
+
+		itemPixels = [self._ConvertNestItem(image, threshold, isHighRes, rotation) for image, threshold, rotation in items]
+		sizes = [(pixels.shape[1], pixels.shape[0]) for pixels in itemPixels]
+
+		nestedLabels = []
+		for placements in self._NestLayout(sizes, maxWidth, maxHeight):
+			# Compose all images of the label into one raster, cut off below the lowest image
+			labelHeight = max(y + sizes[itemIdx][1] for itemIdx, x, y in placements)
+			labelPixels = np.zeros((labelHeight, maxWidth), dtype=np.uint8)
+			for itemIdx, x, y in placements:
+				width, height = sizes[itemIdx]
+				labelPixels[y:y+height, x:x+width] = itemPixels[itemIdx]
+			imageData = self._Convert1bppxImageToEZ30Data(labelPixels.reshape(-1).tolist(), maxWidth, labelHeight, isHighRes)
+			nestedLabels.append({"items": sorted(itemIdx for itemIdx, x, y in placements), "imageData": imageData})
+		return nestedLabels
+
+	def _UnpackEZ30Data(self, ez30ImageData, imgWidth, isHighRes: bool = False):
+		"""Unpacks the line data generated by _Convert1bppxImageToEZ30Data back into pixels,
+		merging the interlaced fields in high res mode.
+		Returns an array with one row per image row, 1 for printed pixels"""
+		data = np.frombuffer(b"".join(ez30ImageData), dtype=np.uint8)
+		if(isHighRes):
+			# Lines come in 'even'/'odd' field pairs, bit k of field f is image row 2*k+f
+			bits = np.unpackbits(data.reshape(-1, 2, 1, imgWidth), axis=2, bitorder="little")
+			bits = bits.transpose(0, 2, 1, 3)
+		else:
+			# Bit k is image row k of the line
+			bits = np.unpackbits(data.reshape(-1, 1, imgWidth), axis=1, bitorder="little")
+		return bits.reshape(-1, imgWidth)
+
+	def _RenderPreview(self, imageData, isHighRes: bool = False):
+		"""Renders converted EZ30 image data as preview of the label.
+		Returns the preview image object"""
+		maxWidth = self.PRINTER_WIDTH
+		maxHeight = self.PRINTER_HEIGHT
+		if(isHighRes):
+			maxWidth = self.PRINTER_HI_RES_WIDTH
+			maxHeight = self.PRINTER_HI_RES_HEIGHT
+		pixels = self._UnpackEZ30Data(imageData, maxWidth, isHighRes)
+		# Pad to the full label so every preview pixel has a source pixel
+		labelPixels = np.zeros((max(len(pixels), maxHeight), maxWidth), dtype=np.uint8)
+		labelPixels[:len(pixels)] = pixels
+
+		# Preview is rotated by 90 degrees, stretched by FACTOR_PREVIEW along the label and
+		# always has the size of the high res one: pick the source pixel for each preview pixel
+		previewWidth = math.floor(self.PRINTER_HI_RES_HEIGHT * self.FACTOR_PREVIEW)
+		previewHeight = self.PRINTER_HI_RES_WIDTH
+		rowIdx = np.arange(previewWidth) * maxHeight // previewWidth
+		colIdx = maxWidth - 1 - np.arange(previewHeight) * maxWidth // previewHeight
+		preview = labelPixels[rowIdx[np.newaxis, :], colIdx[:, np.newaxis]]
+
+		# Printed pixels are black
+		return Image.fromarray(np.where(preview, 0, 255).astype(np.uint8)).convert("1")
+
+	def PreviewLabel(self, image, threshold: int, isHighRes: bool = False, rotation: int = 0):
+		"""Generates a preview image of the label
+		image{str||Image}: 	Path to the image file or Image object that should be printed on the label
+		threshold{int}:		Threshold for converting the image to 1bppx
+		rotation{int}:		Number of counter-clockwise quarter turns applied to the image
+		Returns the preview image object"""
+		imageData = self._ConvertImage(image, threshold, isHighRes, rotation)
+		return self._RenderPreview(imageData, isHighRes)
+
+	def PreviewNestedLabel(self, image, threshold: int, isHighRes: bool = False, rotation: int = 0):
+		"""Generates a preview of an image printed in nesting mode, in its own size at the top of the label
+		image{str||Image}: 	Path to the image file or Image object that should be printed on the label
+		threshold{int}:		Threshold for converting the image to 1bppx
+		rotation{int}:		Number of counter-clockwise quarter turns applied to the image
+		Returns the preview image object"""
+		maxWidth = self.PRINTER_WIDTH
+		if(isHighRes):
+			maxWidth = self.PRINTER_HI_RES_WIDTH
+		itemPixels = self._ConvertNestItem(image, threshold, isHighRes, rotation)
+		labelPixels = np.zeros((itemPixels.shape[0], maxWidth), dtype=np.uint8)
+		labelPixels[:, :itemPixels.shape[1]] = itemPixels
+		imageData = self._Convert1bppxImageToEZ30Data(labelPixels.reshape(-1).tolist(), maxWidth, itemPixels.shape[0], isHighRes)
+		return self._RenderPreview(imageData, isHighRes)
+
+class EZ30Protocol(asyncio.Protocol):
+	"""asyncio protocol parsing the answer byte stream of the EZ30 printer.
+	Tracks the state of the current transmission and resolves the futures
+	the AsyncDriver is waiting on"""
+	## States
+	STATE_IDLE = 0				# Nothing expected, stray bytes are dropped
+	STATE_WAIT_ACK = 1			# Waiting for the ACK of a command byte
+	STATE_SENDING = 2			# Streaming data bytes, watching for PAUSE and DONE
+	STATE_PAUSED = 3			# Printer data buffer full, waiting for it to continue
+	STATE_WAIT_DONE = 4			# Waiting for the instruction to be done
+	STATE_WAIT_DISCOVERY = 5	# Waiting for the discovery answer
+
+	def __init__(self):
+		self.transport = None
+		self.connected = asyncio.get_running_loop().create_future()	# Resolved once the transport is attached
+		self.state = self.STATE_IDLE
+		self.isDone = False			# Printer reported the current instruction as done
+		self.error = None			# Exception raised by the byte stream
+		self.connectionError = None	# Set once the serial connection is lost, never reset
+		self._waiter = None			# Future resolved by the next expected answer
+		self._resumed = asyncio.Event()
+		self._resumed.set()
+
+	def connection_made(self, transport):
+		self.transport = transport
+		if(not self.connected.done()):
+			self.connected.set_result(True)
+
+	def connection_lost(self, exc):
+		self.connectionError = ConnectionError("Serial connection lost: "+str(exc))
+		self._Fail(self.connectionError)
+
+	def data_received(self, data):
+		for value in data:
+			self._HandleAnswer(bytes([value]))
+
+	def _Resolve(self, answer):
+		"""Resolves the pending future with answer"""
+		if(self._waiter is not None and not self._waiter.done()):
+			self._waiter.set_result(answer)
+
+	def _Fail(self, exc):
+		"""Aborts the current transmission with exc"""
+		self.error = exc
+		self.state = self.STATE_IDLE
+		if(self._waiter is not None and not self._waiter.done()):
+			self._waiter.set_exception(exc)
+		# Wake up a sender waiting for the printer to continue
+		self._resumed.set()
+
+	def _HandleAnswer(self, answer):
+		"""State machine handling a single byte sent by the printer"""
+		if(self.state == self.STATE_WAIT_ACK):
+			if(answer == DriverBase.ANSWER_STATUS_DONE):
+				self.isDone = True
+			elif(answer != DriverBase.ANSWER_GOT_INSTRUCTION):
+				self._Fail(ConnectionError("Did not ACK instruction, got "+str(answer)+" instead"))
+				return
+			self.state = self.STATE_SENDING
+			self._Resolve(answer)
+
+		elif(self.state == self.STATE_SENDING):
+			if(answer == DriverBase.ANSWER_PAUSE_DATA):
+				self.state = self.STATE_PAUSED
+				self._resumed.clear()
+			elif(answer == DriverBase.ANSWER_STATUS_DONE):
+				self.isDone = True
+			else:
+				print("Got unknown data packet during transmission: "+str(answer))
+
+		elif(self.state == self.STATE_PAUSED):
+			if(answer == DriverBase.ANSWER_GOT_INSTRUCTION):
+				self.state = self.STATE_SENDING
+				self._resumed.set()
+			elif(answer == DriverBase.ANSWER_DROPPED_DATA):
+				self._Fail(ConnectionError("Dropped some data!"))
+
+		elif(self.state == self.STATE_WAIT_DONE):
+			if(answer == DriverBase.ANSWER_STATUS_DONE):
+				self.isDone = True
+				self.state = self.STATE_IDLE
+				self._Resolve(answer)
+
+		elif(self.state == self.STATE_WAIT_DISCOVERY):
+			self.state = self.STATE_IDLE
+			self._Resolve(answer)
+
+	def Begin(self):
+		"""Resets the state for a new transmission"""
+		self.state = self.STATE_IDLE
+		self.isDone = False
+		self.error = None
+		self._waiter = None
+		self._resumed.set()
+
+	def Expect(self, state):
+		"""Switches to state and returns a future resolved by the awaited answer"""
+		self.state = state
+		self._waiter = asyncio.get_running_loop().create_future()
+		return self._waiter
+
+	def Write(self, data):
+		"""Writes data to the serial transport"""
+		if(self.connectionError is not None):
+			raise self.connectionError
+		if(self.transport is None):
+			raise ConnectionError("Serial port not connected")
+		if(self.error is not None):
+			raise self.error
+		self.transport.write(data)
+
+	async def WaitResumed(self):
+		"""Waits until the printer accepts data again after a PAUSE"""
+		await self._resumed.wait()
+		if(self.error is not None):
+			raise self.error
+
+
+class AsyncDriver(DriverBase):
+	"""Non-blocking EZ30 driver on top of an asyncio serial transport.
+	One event loop can drive several printers concurrently, jobs on the same
+	printer are serialized by a lock"""
+
 	def __init__(self, port):
 		"""Initializes the printer driver
 		port{str}: 		Path to the serial port where the printer is connected(eg /dev/ttyS0 on Linux or COM1 on Windows)"""
 		self.curY = 0				# current y position
 		self.curX = 0				# current x position
 		self.serialPort = port		# path to serial port
-		self.ser = serial.Serial()	# Serial interface
+		self._transport = None		# Serial transport
+		self._protocol = None		# EZ30Protocol parsing the printer answers
+		self._lock = asyncio.Lock()	# One job at a time on this printer
 
-	def InitPrinter(self):
-		"""Initializes the printer"""
-		# Initialize the serial port
-		self._SerialInit()
-		# Check if a printer is connected to the serial port
-		self._DiscoverPrinter()
-		# Initialize the printer
-		self._InitEZ30()
-
-		# Wait for init
-		time.sleep(1)
-
-		# Print one empty line to flush out garbage data in printer
-		row = [0] * self.PRINTER_HI_RES_WIDTH
-		self._PrintImageLine(row, len(row))
-		self._MoveHeadHome()
-
-	def PrintLabelOld(self, image, threshold: int, isHighRes: bool = False):
-		"""Prints a label
-		image{str||Image}: 	Path to the image file or Image object that should be printed on the label
-		threshold{int}:		Threshold for converting the image to 1bppx"""
-		imageData = self._ConvertImage(image, threshold, isHighRes)
-		self._initResMode(isHighRes)
-		self._MoveHeadHome()
-		# Print image row by row
-		for idx,row in enumerate(imageData):
-			self._MoveHeadY(0)
-			time.sleep(0.1)
-			self._PrintImageLine(row, len(row))
-			if(isHighRes and (idx & 1)==1):
-				self._SendData(self.CMD_HI_RES_LINEFEED)
-			elif(isHighRes):
-				self._SendData(self.CMD_HI_RES_SECOND_LINE)
+	async def _SerialInit(self):
+		"""Opens the serial transport.
+		Throws exception if port could not be opened"""
+		self.close()
+		try:
+			# Baudrate required by printer
+			self._transport, self._protocol = await serial_asyncio.create_serial_connection(
+				asyncio.get_running_loop(), EZ30Protocol, self.serialPort, baudrate=9600)
+			# connection_made is only called on the next loop iteration
+			await self._WaitFor(self._protocol.connected, "Serial port did not connect in time!")
+			self._transport.serial.reset_input_buffer()
+			self._transport.serial.reset_output_buffer()
+		except Exception as e:
+			print("Could not open serial port: " + self.serialPort)
+			raise e
+
+	async def _WaitFor(self, awaitable, errorMessage):
+		"""Waits for awaitable at most SERIAL_COMMAND_TIMEOUT seconds.
+		Throws ConnectionError with errorMessage on timeout"""
+		try:
+			return await asyncio.wait_for(awaitable, self.SERIAL_COMMAND_TIMEOUT)
+		except asyncio.TimeoutError:
+			raise ConnectionError(errorMessage)
+
+	async def _SendData(self, barrData, doACKCheck = True):
+		"""Sends a bytearray to the printer.
+		Waits SERIAL_CHAR_DELAY after each byte since the printer needs time
+		to process each byte, answers are handled by the EZ30Protocol"""
+		protocol = self._protocol
+		if(protocol is None):
+			raise ConnectionError("Serial port not open")
+		protocol.Begin()
+
+		for idx,data in enumerate(barrData):
+			dataByte = bytes([(data & 0xFF)])
+			if(idx == 0):
+				# "Command" -> expected Answer is 0x00
+				ack = protocol.Expect(protocol.STATE_WAIT_ACK)
+				protocol.Write(dataByte)
+				await self._WaitFor(ack, "Did not ACK instruction in time!")
 			else:
-				self._MoveDown()
+				protocol.Write(dataByte)
 
-		self._EndPrint()
+			await asyncio.sleep(self.SERIAL_CHAR_DELAY)
+			if(protocol.state == protocol.STATE_PAUSED):
+				# Wait until we can send more data
+				await self._WaitFor(protocol.WaitResumed(), "Did not get a continue in time!")
+			if(protocol.error is not None):
+				raise protocol.error
 
-	def PrintLabel(self, image, threshold: int, isHighRes: bool = False):
-		"""Prints a label faster!
-		image{str||Image}: 	Path to the image file or Image object that should be printed on the label
-		threshold{int}:		Threshold for converting the image to 1bppx"""
-		imageData = self._ConvertImage(image, threshold, isHighRes)
-		self._initResMode(isHighRes)
-		self._MoveHeadHome()
+		if(doACKCheck and not protocol.isDone):
+			done = protocol.Expect(protocol.STATE_WAIT_DONE)
+			await self._WaitFor(done, "Did not get an ACK in time!")
+		protocol.state = protocol.STATE_IDLE
+
+	async def _DiscoverPrinter(self):
+		"""Sends a discovery sequence to the printer and awaits a response.
+		Throws exception if no answer was received"""
+		await self._SendData(self.CMD_START)
+		answer = self._protocol.Expect(self._protocol.STATE_WAIT_DISCOVERY)
+		self._protocol.Write(self.CMD_DISCOVERY)
+		# Printer usually sends 3 bytes, the discovery answer being the last one
+		try:
+			retVal = await self._WaitFor(answer, "No discovery answer in time!")
+		except ConnectionError:
+			retVal = None
+		if(retVal != self.ANSWER_DISCOVERY):
+			raise ConnectionAbortedError("No EZ30 printer connected to port \""+self.serialPort+"\"")
+		await self._SendData(self.CMD_RESET)
+
+	async def _MoveHeadY(self, absolutePos):
+		"""Set absolute y direction of print head"""
+		barrData = [0] * 2
+		relativePos = abs(absolutePos-self.curY)
+		# Check in which direction to move
+		if(absolutePos >= self.curY):
+			barrData[0] = self.CMD_Y_MOVE_RIGHT[0]
+		else:
+			barrData[0] = self.CMD_Y_MOVE_LEFT[0]
+		barrData[1] = relativePos
+		if(relativePos > 0):
+			await self._SendData(barrData)
+			self.curY = absolutePos
+
+	async def _MoveHeadX(self, absolutePos):
+		"""Set absolute x direction of print head"""
+		if(absolutePos < self.curX):
+			# Cant move upwards
+			return -1;
+		relativePos = absolutePos-self.curX
+		for i in range(relativePos // 8):
+			await self._SendData(self.CMD_LINE_FEED)
+		for i in range(relativePos % 8):
+			await self._SendData(self.CMD_HI_RES_SECOND_LINE)
+		self.curX = absolutePos
+
+	async def _MoveHeadHome(self):
+		"""Moves head back to home"""
+		await self._SendData(self.CMD_HOME)
+		self.curY = 0
+
+	async def _MoveHead(self, X,Y):
+		"""Sets x and y position of print head"""
+		await self._MoveHeadX(X)
+		await self._MoveHeadY(Y)
+
+	async def _MoveDown(self):
+		"""Moves 1 line down"""
+		await self._SendData(self.CMD_HI_RES_LINEFEED)
+		await self._SendData(self.CMD_HI_RES_SECOND_LINE)
+
+	async def _InitEZ30(self):
+		"""Initializes the EZ30 printer"""
+		await self._SendData(self.CMD_INIT_SEQUENCE)
+		await self._SendData(self.CMD_HOME)
+		await self._initResMode(True) # Standard Init in High res mode
+		self.curX = 0
+		self.curY = 0
+
+	async def _EndPrint(self):
+		"""Feeds label out"""
+		await self._SendData(self.CMD_HOME)
+		await self._SendData(self.CMD_FEED_LABEL_OUT)
+
+	async def _PrintImageLine(self, barrImageData, length):
+		"""Prints one line of image data"""
+		# Have to send start byte and length as well
+		barrLength = length + 1 + len(self.CMD_IMAGE_SEQUENCE_START)
+		barrData = [0] * barrLength
+		barrData[0] = self.CMD_IMAGE_SEQUENCE_START[0]
+		barrData[1] = length
+		# Copy image data
+		for i in range (length):
+			barrData[2+i] = barrImageData[i]
+		# Increment current y position
+		self.curY += length
+		await self._SendData(barrData)
+
+	async def _initResMode(self, isHighRes:bool = False):
+		if isHighRes:
+			await self._SendData(self.CMD_HI_RES_INIT)
+		else:	
+			await self._SendData(self.CMD_LO_RES_INIT)
+
+	async def _LineFeed(self, lineIdx, isHighRes: bool = False):
+		"""Moves the print head to the next line, alternating the interlaced fields in high res mode"""
+		if(isHighRes and (lineIdx & 1)==1):
+			await self._SendData(self.CMD_HI_RES_LINEFEED)
+		elif(isHighRes):
+			await self._SendData(self.CMD_HI_RES_SECOND_LINE)
+		else:
+			await self._MoveDown()
+
+	async def _PrintImageData(self, imageData, isHighRes: bool = False):
+		"""Prints converted EZ30 image data in one print pass and feeds the label out"""
+		loop = asyncio.get_running_loop()
+		allLinesData = await loop.run_in_executor(None, self._ConvertToLines, imageData, isHighRes)
+		await self._initResMode(isHighRes)
+		await self._MoveHeadHome()
 
 		if(isHighRes):
-			self._MoveHeadY(self.PRINTER_HI_RES_WIDTH)
+			await self._MoveHeadY(self.PRINTER_HI_RES_WIDTH)
 		else:
-			self._MoveHeadY(self.PRINTER_WIDTH)
-		self._MoveHeadY(0)
+			await self._MoveHeadY(self.PRINTER_WIDTH)
+		await self._MoveHeadY(0)
 
-		allLinesData = self._ConvertToLines(imageData, isHighRes)
 		for lineIdx, lineData in enumerate(allLinesData):
 			if(len(lineData) > 0):
 				# Actual printing
 				for segment in lineData:
-					self._MoveHeadY(segment["offs"])
-					self._PrintImageLine(segment["data"], segment["length"])
+					await self._MoveHeadY(segment["offs"])
+					await self._PrintImageLine(segment["data"], segment["length"])
 			# Move print head
-			if(isHighRes and (lineIdx & 1)==1):
-				self._SendData(self.CMD_HI_RES_LINEFEED)
-			elif(isHighRes):
-				self._SendData(self.CMD_HI_RES_SECOND_LINE)
-			else:
-				self._MoveDown()
-			time.sleep(0.1)
+			await self._LineFeed(lineIdx, isHighRes)
+			await asyncio.sleep(0.1)
 
-		self._EndPrint()
+		await self._EndPrint()
 
+	async def init(self):
+		"""Initializes the printer"""
+		async with self._lock:
+			# Initialize the serial port
+			await self._SerialInit()
+			# Check if a printer is connected to the serial port
+			await self._DiscoverPrinter()
+			# Initialize the printer
+			await self._InitEZ30()
+
+			# Wait for init
+			await asyncio.sleep(1)
+
+			# Print one empty line to flush out garbage data in printer
+			row = [0] * self.PRINTER_HI_RES_WIDTH
+			await self._PrintImageLine(row, len(row))
+			await self._MoveHeadHome()
+
+	async def print_label_old(self, image, threshold: int, isHighRes: bool = False, rotation: int = 0):
+		"""Prints a label row by row
+		image{str||Image}: 	Path to the image file or Image object that should be printed on the label
+		threshold{int}:		Threshold for converting the image to 1bppx
+		rotation{int}:		Number of counter-clockwise quarter turns applied to the image"""
+		loop = asyncio.get_running_loop()
+		imageData = await loop.run_in_executor(None, self._ConvertImage, image, threshold, isHighRes, rotation)
+		async with self._lock:
+			await self._initResMode(isHighRes)
+			await self._MoveHeadHome()
+			# Print image row by row
+			for idx,row in enumerate(imageData):
+				await self._MoveHeadY(0)
+				await asyncio.sleep(0.1)
+				await self._PrintImageLine(row, len(row))
+				await self._LineFeed(idx, isHighRes)
+
+			await self._EndPrint()
+
+	async def print_label(self, image, threshold: int, isHighRes: bool = False, rotation: int = 0):
+		"""Prints a label faster!
+		Image conversion runs in the default executor so it overlaps with I/O of other printers
+		image{str||Image}: 	Path to the image file or Image object that should be printed on the label
+		threshold{int}:		Threshold for converting the image to 1bppx
+		rotation{int}:		Number of counter-clockwise quarter turns applied to the image"""
+		loop = asyncio.get_running_loop()
+		imageData = await loop.run_in_executor(None, self._ConvertImage, image, threshold, isHighRes, rotation)
+		async with self._lock:
+			await self._PrintImageData(imageData, isHighRes)
+
+	async def print_nested(self, items, isHighRes: bool = False, labelDone = None):
+		"""Nests several small images onto as few labels as possible and prints them, one print pass per label
+		items{list}:		(image, threshold, rotation) tuple for each image, see print_label
+		labelDone{callable}:	Called with the indices of the items on a label once it is printed
+		Returns the number of printed labels"""
+		loop = asyncio.get_running_loop()
+		nestedLabels = await loop.run_in_executor(None, self.NestLabels, items, isHighRes)
+		async with self._lock:
+			for nestedLabel in nestedLabels:
+				await self._PrintImageData(nestedLabel["imageData"], isHighRes)
+				if(labelDone is not None):
+					labelDone(nestedLabel["items"])
+		return len(nestedLabels)
+
+	async def preview(self, image, threshold: int, isHighRes: bool = False, rotation: int = 0):
+		"""Generates a preview image of the label in the default executor
+		image{str||Image}: 	Path to the image file or Image object that should be printed on the label
+		threshold{int}:		Threshold for converting the image to 1bppx
+		rotation{int}:		Number of counter-clockwise quarter turns applied to the image
+		Returns the preview image object"""
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(None, self.PreviewLabel, image, threshold, isHighRes, rotation)
 
-	def PreviewLabel(self, image, threshold: int, isHighRes: bool = False):
-		"""Generates a preview image of the label
+	async def preview_nested(self, image, threshold: int, isHighRes: bool = False, rotation: int = 0):
+		"""Generates a preview of an image printed in nesting mode in the default executor
 		image{str||Image}: 	Path to the image file or Image object that should be printed on the label
 		threshold{int}:		Threshold for converting the image to 1bppx
+		rotation{int}:		Number of counter-clockwise quarter turns applied to the image
 		Returns the preview image object"""
-		resizedImage = self._ResizeImage(image, isHighRes)
-		# enlarge image to make it look more like on the actual label
-		resizedImage = resizedImage.resize((resizedImage.size[0], int(resizedImage.size[1] * self.FACTOR_PREVIEW)) )
-		pixelData, imgWidth, imgHeight = self._ConvertImageTo1bppx(resizedImage, threshold)
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(None, self.PreviewNestedLabel, image, threshold, isHighRes, rotation)
 
-		imgHeight = math.floor(imgHeight * self.FACTOR_PREVIEW)
-		newImg = Image.new("1", (imgWidth, imgHeight))
-		newImg.putdata(pixelData)
-		bwImg = newImg.point((lambda p: p!=1),mode="1")
+	def close(self):
+		"""Closes the serial transport"""
+		if(self._transport is not None):
+			self._transport.close()
+		self._transport = None
+		self._protocol = None
 
+class Driver(DriverBase):
+	"""Blocking EZ30 driver.
+	Thin wrapper running an AsyncDriver on a private event loop"""
 
-		newImg = bwImg.resize((imgWidth, imgHeight))
+	def __init__(self, port):
+		"""Initializes the printer driver
+		port{str}: 		Path to the serial port where the printer is connected(eg /dev/ttyS0 on Linux or COM1 on Windows)"""
+		self.serialPort = port						# path to serial port
+		self._asyncDriver = AsyncDriver(port)		# Driver doing the actual work
+		self._loop = asyncio.new_event_loop()		# Loop the async driver runs on
 
-		maxWidth = self.PRINTER_WIDTH
-		maxHeight = self.PRINTER_HEIGHT
-		if(isHighRes):
-			maxWidth = self.PRINTER_HI_RES_WIDTH
-			maxHeight = self.PRINTER_HI_RES_HEIGHT
-		scaleImg = Image.new("1", (maxWidth, math.floor(maxHeight * self.FACTOR_PREVIEW) ))
-    	#center = (int(0.5 * maxWidth), int(0.5 * maxHeight))
-		ImageDraw.floodfill(scaleImg, xy=(0,0), value=1)
-		scaleImg.paste(newImg)
-		scaleImg = scaleImg.rotate(90, expand=True)
-		if(not isHighRes): # Scale low res preview to same size as high res one
-			scaleImg = scaleImg.resize((math.floor(self.PRINTER_HI_RES_HEIGHT * self.FACTOR_PREVIEW), self.PRINTER_HI_RES_WIDTH ))
-		return scaleImg
+	def _Run(self, coroutine):
+		"""Runs coroutine on the private event loop until it is done"""
+		return self._loop.run_until_complete(coroutine)
+
+	def InitPrinter(self):
+		"""Initializes the printer"""
+		self._Run(self._asyncDriver.init())
+
+	def PrintLabelOld(self, image, threshold: int, isHighRes: bool = False, rotation: int = 0):
+		"""Prints a label
+		image{str||Image}: 	Path to the image file or Image object that should be printed on the label
+		threshold{int}:		Threshold for converting the image to 1bppx
+		rotation{int}:		Number of counter-clockwise quarter turns applied to the image"""
+		self._Run(self._asyncDriver.print_label_old(image, threshold, isHighRes, rotation))
+
+	def PrintLabel(self, image, threshold: int, isHighRes: bool = False, rotation: int = 0):
+		"""Prints a label faster!
+		image{str||Image}: 	Path to the image file or Image object that should be printed on the label
+		threshold{int}:		Threshold for converting the image to 1bppx
+		rotation{int}:		Number of counter-clockwise quarter turns applied to the image"""
+		self._Run(self._asyncDriver.print_label(image, threshold, isHighRes, rotation))
+
+	def PrintNestedLabels(self, items, isHighRes: bool = False, labelDone = None):
+		"""Nests several small images onto as few labels as possible and prints them
+		items{list}:		(image, threshold, rotation) tuple for each image, see PrintLabel
+		labelDone{callable}:	Called with the indices of the items on a label once it is printed
+		Returns the number of printed labels"""
+		return self._Run(self._asyncDriver.print_nested(items, isHighRes, labelDone))
+
+	def Close(self):
+		"""Closes the serial port and the private event loop"""
+		self._asyncDriver.close()
+		self._loop.close()
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import driverEZ30
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="needs a pty")
+
+
+class FakePrinter:
+	"""EZ30 stand-in on the master side of a pty.
+	Answers the discovery byte with the discovery answer and everything else with DONE"""
+
+	def __init__(self):
+		import pty
+		import tty
+		self.master, slave = pty.openpty()
+		tty.setraw(slave)
+		self.port = os.ttyname(slave)
+		self._slave = slave
+		self.received = bytearray()
+		self._thread = threading.Thread(target=self._Run, daemon=True)
+		self._thread.start()
+
+	def _Run(self):
+		while True:
+			try:
+				data = os.read(self.master, 1024)
+			except OSError:
+				return
+			if(not data):
+				return
+			self.received += data
+			for value in data:
+				if(bytes([value]) == driverEZ30.DriverBase.CMD_DISCOVERY):
+					os.write(self.master, driverEZ30.DriverBase.ANSWER_DISCOVERY)
+				else:
+					os.write(self.master, driverEZ30.DriverBase.ANSWER_STATUS_DONE)
+
+	def close(self):
+		os.close(self._slave)
+		os.close(self.master)
+
+
+@pytest.fixture
+def printer():
+	fakePrinter = FakePrinter()
+	yield fakePrinter
+	fakePrinter.close()
+
+
+def _SmallImage():
+	return Image.new("L", (20, 10), 0)
+
+
+def test_async_init_and_print(printer):
+	async def run():
+		driver = driverEZ30.AsyncDriver(printer.port)
+		driver.SERIAL_COMMAND_TIMEOUT = 2
+		try:
+			await driver.init()
+			await driver.print_label(_SmallImage(), 127)
+		finally:
+			driver.close()
+
+	asyncio.run(run())
+	assert driverEZ30.DriverBase.CMD_DISCOVERY in printer.received
+	assert driverEZ30.DriverBase.CMD_FEED_LABEL_OUT in printer.received
+
+
+def test_sync_driver_init(printer):
+	driver = driverEZ30.Driver(printer.port)
+	driver._asyncDriver.SERIAL_COMMAND_TIMEOUT = 2
+	try:
+		driver.InitPrinter()
+	finally:
+		driver.Close()
+	assert driver._loop.is_closed()
+
+
+def test_closed_driver_raises_connection_error(printer):
+	async def run():
+		driver = driverEZ30.AsyncDriver(printer.port)
+		driver.SERIAL_COMMAND_TIMEOUT = 2
+		await driver.init()
+		driver.close()
+		with pytest.raises(ConnectionError):
+			await driver.print_label(_SmallImage(), 127)
+
+	asyncio.run(run())
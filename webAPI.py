@@ -22,6 +22,7 @@ IS_DUMMY = False
 
 labelArray = {}
 printQueue = queue.Queue()
+nestedQueue = queue.Queue() # Nested labels, printed together in batches
 labelLifetime = 60*60
 
 app = Flask(__name__)
@@ -33,6 +34,10 @@ def uploadLabel():
         isHighRes = False
         if('isHighRes' in request.form):
             isHighRes = True
+        # Nested labels are printed together with other queued nested labels
+        isNested = False
+        if('isNested' in request.form):
+            isNested = True
         imageFile = request.files['imageData']
         imageDataB64 = base64.b64encode(imageFile.read())
         if(imageDataB64 == ''):
@@ -44,8 +49,8 @@ def uploadLabel():
             retVal = {"status":"Image could not be parsed properly!", "error":str(e), "statusId":-1}
             return json.dumps(retVal),400
         else:
-            labelId = hex(hash(imageDataB64)+threshold+isHighRes*1234)[:-9:-1] # last 8 hex digits of the hash
-            labelArray[labelId] = {'threshold':threshold, 'printCount': 0, 'isHighRes': isHighRes, 'imageDataB64':imageDataB64, 'status':"Uploaded", 'statusId':STATUS_UPLOADED, 'timestamp':time.time()}
+            labelId = hex(hash(imageDataB64)+threshold+isHighRes*1234+isNested*5678)[:-9:-1] # last 8 hex digits of the hash
+            labelArray[labelId] = {'threshold':threshold, 'printCount': 0, 'isHighRes': isHighRes, 'isNested': isNested, 'rotation': 0, 'imageDataB64':imageDataB64, 'status':"Uploaded", 'statusId':STATUS_UPLOADED, 'timestamp':time.time()}
             retVal = {"labelId":labelId}
             return json.dumps(retVal),200
        
@@ -56,20 +61,11 @@ def rotateLabel(labelId):
         if( labelId not in labelArray ):
             retVal = {"status":"Invalid label id!", "statusId":-1}
             return json.dumps(retVal),400
-        imageDataB64 = labelArray[labelId]['imageDataB64']
-        try:
-            im = Image.open(BytesIO(base64.b64decode(imageDataB64))) 
-            convImg = im.rotate(90, expand=True)
-            buffer = BytesIO()
-            convImg.save(buffer,format="PNG")
-            myimage = buffer.getvalue()   
-            labelArray[labelId]['imageDataB64'] = base64.b64encode(myimage)
-            labelArray[labelId]['timestamp'] = time.time()
-            retVal = {"status":"Image rotated 90 degrees", "statusId":labelArray[labelId]['statusId']}
-            return json.dumps(retVal),200
-        except Exception as e:
-            retVal = {"status":"Image could not be parsed properly!", "error":str(e), "statusId":labelArray[labelId]['statusId']}
-            return json.dumps(retVal),400
+        # Rotation is only stored as quarter turns and applied by the driver on conversion
+        labelArray[labelId]['rotation'] = (labelArray[labelId]['rotation'] + 1) % 4
+        labelArray[labelId]['timestamp'] = time.time()
+        retVal = {"status":"Image rotated 90 degrees", "statusId":labelArray[labelId]['statusId']}
+        return json.dumps(retVal),200
 
 @app.route('/<string:labelId>/setThreshold', methods = ['POST'])###
 def setThreshold(labelId):
@@ -97,10 +93,14 @@ def previewLabel(labelId):
             return json.dumps(retVal),400
         threshold = labelArray[labelId]['threshold']
         isHighRes = labelArray[labelId]['isHighRes']
+        rotation = labelArray[labelId]['rotation']
         imageDataB64 = labelArray[labelId]['imageDataB64']
         try:
             im = Image.open(BytesIO(base64.b64decode(imageDataB64))) 
-            convImg = ez30.PreviewLabel(im, threshold, isHighRes)
+            if labelArray[labelId]['isNested']:
+                convImg = ez30.PreviewNestedLabel(im, threshold, isHighRes, rotation)
+            else:
+                convImg = ez30.PreviewLabel(im, threshold, isHighRes, rotation)
             buffer = BytesIO()
             convImg.save(buffer,format="PNG")
             myimage = buffer.getvalue()   
@@ -152,7 +152,10 @@ def printLabel(labelId):
             labelArray[labelId]['status'] = "Starting print!"
             labelArray[labelId]['statusId'] = STATUS_START_PRINT
             labelArray[labelId]['printCount'] = count
-            printQueue.put(labelId)
+            if labelArray[labelId]['isNested']:
+                nestedQueue.put(labelId)
+            else:
+                printQueue.put(labelId)
             retVal = {"status":"Starting Print!", "statusId":labelArray[labelId]['statusId']}
             labelArray[labelId]['timestamp'] = time.time()
             return json.dumps(retVal),200
@@ -167,19 +170,22 @@ def after_request(response):
     header['Access-Control-Allow-Origin'] = '*'
     return response
 
-def printLabelThread(labelQueue):
+def printLabelThread(labelQueue, nestedLabelQueue):
     while True:
         time.sleep(1)
+        if not nestedLabelQueue.empty():
+            printNestedLabels(nestedLabelQueue)
         if not labelQueue.empty():
             labelId = labelQueue.get()
             print("Starting print of label: "+str(labelId))
             try:
                 threshold = labelArray[labelId]['threshold']
                 isHighRes = labelArray[labelId]['isHighRes']
+                rotation = labelArray[labelId]['rotation']
                 imageDataB64 = labelArray[labelId]['imageDataB64']
                 im = Image.open(BytesIO(base64.b64decode(imageDataB64))) 
                 if not IS_DUMMY:
-                    ez30.PrintLabel(im, threshold, isHighRes)
+                    ez30.PrintLabel(im, threshold, isHighRes, rotation)
                 labelArray[labelId]['printCount'] -= 1
                 labelArray[labelId]['status'] = "Print Done!"
                 labelArray[labelId]['statusId'] = STATUS_DONE
@@ -192,6 +198,58 @@ def printLabelThread(labelQueue):
             finally:
                 labelQueue.task_done()
 
+def printNestedLabels(nestedLabelQueue):
+    """Prints all queued nested labels, one batch per resolution"""
+    nestedIds = []
+    while not nestedLabelQueue.empty():
+        labelId = nestedLabelQueue.get()
+        nestedLabelQueue.task_done()
+        if labelId not in nestedIds and labelId in labelArray:
+            nestedIds.append(labelId)
+    for isHighRes in (False, True):
+        batchIds = [labelId for labelId in nestedIds if labelId in labelArray and labelArray[labelId]['isHighRes'] == isHighRes]
+        if len(batchIds) > 0:
+            printNestedBatch(batchIds, isHighRes)
+
+def printNestedBatch(nestedIds, isHighRes):
+    """Prints the nested labels `nestedIds` together.
+    All copies are packed onto as few labels as possible, the status of each label is updated
+    as soon as all of its copies are printed. Labels deleted in the meantime are skipped"""
+    print("Starting nested print of labels: "+str(nestedIds))
+    items = []
+    itemLabelIds = []
+    for nestedId in nestedIds:
+        label = labelArray.get(nestedId)
+        if label is None:
+            continue
+        im = Image.open(BytesIO(base64.b64decode(label['imageDataB64']))) 
+        for i in range(label['printCount']):
+            items.append((im, label['threshold'], label['rotation']))
+            itemLabelIds.append(nestedId)
+
+    def labelDone(itemIdxs):
+        for itemIdx in itemIdxs:
+            label = labelArray.get(itemLabelIds[itemIdx])
+            if label is None:
+                continue
+            label['printCount'] -= 1
+            if label['printCount'] <= 0:
+                label['status'] = "Print Done!"
+                label['statusId'] = STATUS_DONE
+
+    try:
+        if not IS_DUMMY:
+            ez30.PrintNestedLabels(items, isHighRes, labelDone)
+        else:
+            labelDone(range(len(items)))
+    except Exception as e:
+        print(e)
+        for nestedId in nestedIds:
+            label = labelArray.get(nestedId)
+            if label is not None and label['printCount'] > 0:
+                label['status'] = "Printing failed with exception: "+str(e)
+                label['statusId'] = STATUS_PRINT_FAILED
+
 def garbageCollectionThread():
     """Removes all labels older than `labelLifetime` from the `labelArray`"""
     while True:
@@ -207,7 +265,7 @@ if __name__ == '__main__':
     ez30 = driverEZ30.Driver(EZ30_TTY_PORT)
     if not IS_DUMMY:
         ez30.InitPrinter()
-    pLT = Thread(target=printLabelThread,args=(printQueue,))
+    pLT = Thread(target=printLabelThread,args=(printQueue,nestedQueue))
     pLT.start()
     gCT = Thread(target=garbageCollectionThread,args=())
     gCT.start()